@@ -1,11 +1,18 @@
 from google.genai import types
-print("LiveConnectConfig fields:")
-try:
-    print(types.LiveConnectConfig.model_fields['proactivity'])
-except:
-    pass
-
-print("\nSearching for Proactivity types:")
-for name in dir(types):
-    if 'Proactivity' in name:
-        print(name)
+
+
+def main():
+    print("LiveConnectConfig fields:")
+    try:
+        print(types.LiveConnectConfig.model_fields['proactivity'])
+    except Exception as e:
+        print(f"Could not read proactivity field: {e!r}")
+
+    print("\nSearching for Proactivity types:")
+    for name in dir(types):
+        if 'Proactivity' in name:
+            print(name)
+
+
+if __name__ == "__main__":
+    main()
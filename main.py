@@ -8,15 +8,22 @@ with Google's Gemini Live API using the official Python SDK.
 
 import asyncio
 import base64
-import json
 import os
 import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, NamedTuple
 
+import httpx
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from google import genai
 from google.genai import types
+from websockets.protocol import State
 
 # Configure logging
 logging.basicConfig(
@@ -25,11 +32,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Pre-warm Gemini connections on startup and close everything on shutdown."""
+    pool.start(SessionOptions())
+    yield
+    # uvicorn usually closes client connections before this runs; close any that remain
+    await manager.close_all()
+    await pool.close()
+
+
 # Initialize FastAPI
 app = FastAPI(
     title="Gemini Live API Backend",
     description="WebSocket server for Gemini Live audio streaming",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware for frontend access
@@ -55,10 +73,43 @@ if not GOOGLE_API_KEY:
 MODEL = "gemini-2.5-flash-native-audio-preview-12-2025"
 SAMPLE_RATE = 16000  # Input audio sample rate
 OUTPUT_SAMPLE_RATE = 24000  # Output audio sample rate
+PCM_MIME = f"audio/pcm;rate={SAMPLE_RATE}"  # MIME type for input audio blobs
 DEFAULT_VOICE_NAME = os.getenv("DEFAULT_VOICE_NAME", "Aoede")
-
-# Initialize Gemini client
-client = genai.Client(api_key=GOOGLE_API_KEY, http_options={"api_version": "v1alpha"})
+OUTBOUND_QUEUE_SIZE = 256  # Max messages buffered per client before backpressure
+AUDIO_SEND_QUEUE_SIZE = 20  # Max input audio chunks buffered for Gemini (~400 ms); oldest are dropped
+TRANSCRIPTION_FLUSH_DELAY = 0.04  # Seconds to coalesce transcription fragments
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "2"))  # Pre-warmed Gemini connections for default options
+# Seconds an unused pre-warmed connection is kept. Live connections have a limited
+# lifetime (about 10 minutes), so a short TTL keeps most of it for the client.
+# Expired connections are not replaced until a client connects again.
+WARM_SESSION_TTL = float(os.getenv("WARM_SESSION_TTL", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "256"))  # Shared Gemini REST connection pool
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "128"))
+
+# Server -> client frames are binary; the first byte says what follows
+OP_AUDIO = b"\x01"  # Raw 24kHz PCM audio
+OP_TRANSCRIPT_IN = b"\x02"  # UTF-8 transcription of user speech
+OP_TRANSCRIPT_OUT = b"\x03"  # UTF-8 transcription of Gemini speech
+OP_CTRL = b"\x04"  # JSON control message
+
+# Fixed control messages, serialized once
+MSG_TURN_COMPLETE = OP_CTRL + orjson.dumps({"type": "turn_complete"})
+MSG_INTERRUPTED = OP_CTRL + orjson.dumps({"type": "interrupted"})
+
+# Initialize Gemini client (shared by the whole process); its async httpx pool
+# is sized for many concurrent sessions
+client = genai.Client(
+    api_key=GOOGLE_API_KEY,
+    http_options={
+        "api_version": "v1alpha",
+        "async_client_args": {
+            "limits": httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+            )
+        }
+    }
+)
 
 SYSTEM_INSTRUCTION = """
 
@@ -201,52 +252,225 @@ TOOLS = [
     }
 ]
 
+class SessionOptions(NamedTuple):
+    """Per-client choices that shape the Gemini session config."""
+    voice_name: str = DEFAULT_VOICE_NAME
+    input_tx: bool = True
+    output_tx: bool = True
+    thoughts: bool = True
+
+
+@lru_cache(maxsize=32)
+def make_config(*, voice_name: str, input_tx: bool, output_tx: bool, thoughts: bool) -> types.LiveConnectConfig:
+    """Build the Live session config; cached because only a few combinations occur."""
+    return types.LiveConnectConfig(
+        response_modalities=["AUDIO"],
+        tools=TOOLS,
+        system_instruction=types.Content(parts=[types.Part(text=SYSTEM_INSTRUCTION)]),
+        proactivity=types.ProactivityConfig(proactive_audio=True),
+        input_audio_transcription=types.AudioTranscriptionConfig() if input_tx else None,
+        speech_config=types.SpeechConfig(
+            voice_config=types.VoiceConfig(
+                prebuilt_voice_config=types.PrebuiltVoiceConfig(
+                    voice_name=voice_name
+                )
+            )
+        ),
+        temperature=0.2,
+        enable_affective_dialog=True,
+        output_audio_transcription=types.AudioTranscriptionConfig() if output_tx else None,
+        thinking_config=types.ThinkingConfig(include_thoughts=thoughts, thinking_budget=1024),
+    )
+
+
+_ws_missing_logged = False
+
+
+def _is_open(session) -> bool:
+    """Whether a Live session's websocket is still open.
+
+    Reads the SDK's private _ws. If that is missing, the connection is assumed open
+    and a dead one is caught by GeminiSession._recover() on first use instead.
+    """
+    global _ws_missing_logged
+    ws = getattr(session, "_ws", None)
+    if ws is None:
+        if not _ws_missing_logged:
+            logger.warning("Live session has no _ws attribute; pooled connections are not health-checked")
+            _ws_missing_logged = True
+        return True
+    return ws.state is State.OPEN
+
+
+class LiveSessionPool:
+    """Keeps pre-warmed Gemini Live connections so new clients skip the handshake.
+
+    A connection carries its conversation history, so it is only handed out once
+    and is closed when its client is done rather than returned to the pool.
+    Idle connections older than WARM_SESSION_TTL are closed in the background, so
+    a client never gets one that has used much of the Live connection lifetime.
+    The pool is only refilled when a client acquires a connection, so an idle
+    server does not keep opening Live sessions.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._idle: Dict[SessionOptions, asyncio.Queue] = {}
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+        self._closing = set()
+        self._closed = False
+
+    async def open(self, options: SessionOptions):
+        """Open a new connection, bypassing the pool."""
+        session_manager = client.aio.live.connect(model=MODEL, config=make_config(**options._asdict()))
+        session = await session_manager.__aenter__()
+        return session_manager, session
+
+    def _usable(self, session, created_at: float) -> bool:
+        return time.monotonic() - created_at < WARM_SESSION_TTL and _is_open(session)
+
+    async def acquire(self, options: SessionOptions):
+        """Return (session_manager, session, pooled), preferring a pre-warmed connection."""
+        queue = self._idle.get(options)
+        if queue is not None:
+            while not queue.empty():
+                session_manager, session, created_at = queue.get_nowait()
+                if self._usable(session, created_at):
+                    self.schedule_refill(options)
+                    logger.info("Using pre-warmed Gemini connection")
+                    return session_manager, session, True
+                self.discard(session_manager)
+            self.schedule_refill(options)
+        session_manager, session = await self.open(options)
+        return session_manager, session, False
+
+    async def release(self, session_manager):
+        """Close a connection once its client is done with it."""
+        await session_manager.__aexit__(None, None, None)
+
+    def discard(self, session_manager):
+        """Close a stale connection in the background."""
+        self._spawn(self._close_quietly(session_manager), self._closing)
+
+    async def _close_quietly(self, session_manager):
+        try:
+            await self.release(session_manager)
+        except Exception as e:
+            logger.error("Error closing pooled session: %s", e)
+
+    async def warm(self, options: SessionOptions):
+        """Fill the pool for a set of session options up to maxsize."""
+        async with self._lock:
+            queue = self._idle.setdefault(options, asyncio.Queue(maxsize=self.maxsize))
+            while not queue.full() and not self._closed:
+                session_manager, session = await self.open(options)
+                if self._closed:
+                    await self._close_quietly(session_manager)
+                    return
+                queue.put_nowait((session_manager, session, time.monotonic()))
+
+    def start(self, options: SessionOptions):
+        """Warm the pool and start expiring stale connections in the background."""
+        if self.maxsize <= 0:
+            return
+        self.schedule_refill(options)
+        self._spawn(self._reap())
+
+    async def _reap(self):
+        """Periodically close expired or closed idle connections."""
+        while True:
+            await asyncio.sleep(WARM_SESSION_TTL / 2)
+            for options, queue in list(self._idle.items()):
+                fresh = []
+                while not queue.empty():
+                    session_manager, session, created_at = queue.get_nowait()
+                    if self._usable(session, created_at):
+                        fresh.append((session_manager, session, created_at))
+                    else:
+                        self.discard(session_manager)
+                for entry in fresh:
+                    queue.put_nowait(entry)
+
+    def schedule_refill(self, options: SessionOptions):
+        """Warm the pool for a set of session options in the background."""
+        if self.maxsize <= 0 or self._closed:
+            return
+        self._spawn(self._refill(options))
+
+    def _spawn(self, coro, tasks=None):
+        tasks = self._tasks if tasks is None else tasks
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _refill(self, options: SessionOptions):
+        try:
+            await self.warm(options)
+        except Exception as e:
+            logger.warning("Error warming Gemini connection pool: %s", e)
+
+    async def close(self):
+        """Stop background work and close all idle connections."""
+        self._closed = True
+        for task in list(self._tasks):
+            task.cancel()
+        # Wait for cancelled refills so none leaves a connection open, and for pending closes
+        await asyncio.gather(*self._tasks, *self._closing, return_exceptions=True)
+        for queue in self._idle.values():
+            while not queue.empty():
+                session_manager, _, _ = queue.get_nowait()
+                await self._close_quietly(session_manager)
+        self._idle.clear()
+
+
+pool = LiveSessionPool(WARM_POOL_SIZE)
+
+
 class GeminiSession:
     """Manages a Gemini Live API session using the official SDK."""
     
-    def __init__(self, client_ws: WebSocket, voice_name: str = DEFAULT_VOICE_NAME):
-        self.client_ws = client_ws
+    def __init__(self, manager: "ConnectionManager", session_id: str, options: SessionOptions = SessionOptions(), legacy_json: bool = False):
+        self.manager = manager
+        self.session_id = session_id
+        # Legacy clients get JSON text frames with base64 audio instead of opcode frames
+        self.legacy_json = legacy_json
         self.session = None
         self.session_manager = None
         self.is_active = False
         self.receive_task = None
-        self.voice_name = voice_name
+        self.options = options
+        self.voice_name = options.voice_name
+        self.out_q = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self.writer_task = None
+        self.audio_out_q = asyncio.Queue(maxsize=AUDIO_SEND_QUEUE_SIZE)
+        self.audio_sender_task = None
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._in_tx_buf = []
+        self._out_tx_buf = []
+        self._flush_task = None
+        self._verified = False
+        self._recover_lock = asyncio.Lock()
         
     async def connect(self):
         """Connect to Gemini Live API using the official SDK."""
         try:
-            logger.info(f"Connecting to Gemini model: {MODEL}")
-            
-            # Configure the session
-            config = types.LiveConnectConfig(
-                response_modalities=["AUDIO"],
-                tools=TOOLS,
-                system_instruction=types.Content(parts=[types.Part(text=SYSTEM_INSTRUCTION)]),
-                proactivity=types.ProactivityConfig(proactive_audio=True),
-                input_audio_transcription=types.AudioTranscriptionConfig(),
-                speech_config=types.SpeechConfig(
-                    voice_config=types.VoiceConfig(
-                        prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                            voice_name=self.voice_name
-                        )
-                    )
-                ),
-                temperature=0.2,
-                enable_affective_dialog=True,
-                output_audio_transcription=types.AudioTranscriptionConfig(),
-                thinking_config=types.ThinkingConfig(include_thoughts=True, thinking_budget=1024),
-            )
+            logger.info("Connecting to Gemini model: %s", MODEL)
             
             # Connect to Gemini Live API - get the actual session object
-            session_manager = client.aio.live.connect(model=MODEL, config=config)
-            self.session = await session_manager.__aenter__()
+            session_manager, self.session, pooled = await pool.acquire(self.options)
             self.session_manager = session_manager  # Keep for cleanup
+            # A fresh connection is known good; a pooled one is verified by its first response
+            self._verified = not pooled
             
             logger.info("Connected to Gemini Live API")
             self.is_active = True
+            self.writer_task = asyncio.create_task(self._writer())
+            self.audio_sender_task = asyncio.create_task(self._audio_sender())
             
             # Notify client of successful connection
-            await self.client_ws.send_json({
+            await self.send_json({
                 "type": "connected",
                 "message": "Successfully connected to Gemini",
                 "voice": self.voice_name
@@ -255,42 +479,169 @@ class GeminiSession:
             return True
             
         except Exception as e:
-            logger.error(f"Error connecting to Gemini: {e}")
+            logger.error("Error connecting to Gemini: %s", e)
             self.is_active = False
             raise
     
-    async def send_audio(self, audio_base64: str):
-        """Send audio chunk to Gemini."""
+    async def _writer(self):
+        """Drain the outbound queue to the client WebSocket."""
+        try:
+            while True:
+                message = await self.out_q.get()
+                if isinstance(message, bytes):
+                    await self.manager.send_bytes(self.session_id, message)
+                else:
+                    await self.manager.send_text(self.session_id, message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Error sending to client: %s", e)
+            self.is_active = False
+
+    async def _enqueue(self, message):
+        """Queue a message for the writer task; only waits if the client has fallen far behind."""
+        try:
+            self.out_q.put_nowait(message)
+        except asyncio.QueueFull:
+            await self.out_q.put(message)
+
+    async def send_json(self, data: dict):
+        """Serialize a control message and queue it for the client."""
+        await self._send_ctrl(OP_CTRL + orjson.dumps(data))
+
+    async def _send_ctrl(self, frame: bytes):
+        """Queue a serialized OP_CTRL frame; legacy clients get the bare JSON as a text frame."""
+        await self._enqueue(frame[1:].decode() if self.legacy_json else frame)
+
+    async def _send_legacy_audio(self, audio_data: bytes):
+        """Queue an audio_response JSON message with base64 audio, encoded off the event loop."""
+        loop = asyncio.get_running_loop()
+        audio_base64 = await loop.run_in_executor(None, base64.b64encode, audio_data)
+        await self._enqueue(orjson.dumps({
+            "type": "audio_response",
+            "data": audio_base64.decode()
+        }).decode())
+
+    def _schedule_flush(self):
+        """Flush buffered transcription fragments after a short delay."""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_delay())
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(TRANSCRIPTION_FLUSH_DELAY)
+        self._flush_task = None
+        await self.flush_transcriptions()
+
+    async def flush_transcriptions(self):
+        """Send buffered transcription fragments as one message per direction."""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        if self._in_tx_buf:
+            user_text = "".join(self._in_tx_buf)
+            self._in_tx_buf.clear()
+            if self.legacy_json:
+                await self.send_json({"type": "transcription", "text": user_text})
+            else:
+                await self._enqueue(OP_TRANSCRIPT_IN + user_text.encode())
+
+        if self._out_tx_buf:
+            ai_text = "".join(self._out_tx_buf)
+            self._out_tx_buf.clear()
+            if self.legacy_json:
+                await self.send_json({"type": "ai_transcription", "text": ai_text})
+            else:
+                await self._enqueue(OP_TRANSCRIPT_OUT + ai_text.encode())
+
+    async def send_audio(self, audio_bytes: bytes):
+        """Queue a raw PCM audio chunk for Gemini, dropping the oldest chunk if Gemini is behind."""
         if not self.session or not self.is_active:
             logger.warning("Cannot send audio - session not active")
             return
-        
+
         try:
-            # Decode base64 audio
-            audio_bytes = base64.b64decode(audio_base64)
-            logger.debug(f"Decoded {len(audio_bytes)} bytes of PCM audio")
-            
-            # Send realtime input to Gemini using Blob
-            await self.session.send_realtime_input(
-                media=types.Blob(
-                    data=audio_bytes,
-                    mimeType=f"audio/pcm;rate={SAMPLE_RATE}"
-                )
-            )
-            logger.debug(f"Sent {len(audio_bytes)} bytes to Gemini")
-            
+            self.audio_out_q.put_nowait(audio_bytes)
+        except asyncio.QueueFull:
+            self.audio_out_q.get_nowait()
+            self.audio_out_q.task_done()
+            self.audio_out_q.put_nowait(audio_bytes)
+            logger.debug("Audio send queue full - dropped oldest chunk")
+
+    async def _audio_sender(self):
+        """Forward queued audio chunks to Gemini."""
+        try:
+            while self.is_active:
+                audio_bytes = await self.audio_out_q.get()
+                try:
+                    # Send realtime input to Gemini using Blob
+                    await self._send_to_gemini(lambda session: session.send_realtime_input(
+                        media=types.Blob(
+                            data=audio_bytes,
+                            mimeType=PCM_MIME
+                        )
+                    ))
+                finally:
+                    self.audio_out_q.task_done()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Sent %d bytes to Gemini", len(audio_bytes))
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Error sending audio to Gemini: {e}")
+            logger.error("Error sending audio to Gemini: %s", e)
             self.is_active = False
+            await self.send_json({
+                "type": "error",
+                "message": str(e)
+            })
+        finally:
+            # Release send_control() callers waiting on audio that will never be sent
+            while not self.audio_out_q.empty():
+                self.audio_out_q.get_nowait()
+                self.audio_out_q.task_done()
+
+    async def send_control(self, send):
+        """Run send(session) once all audio queued before it has reached Gemini."""
+        if not self.session or not self.is_active:
+            logger.warning("Cannot send to Gemini - session not active")
+            return
+        await self.audio_out_q.join()
+        await send(self.session)
+
+    async def _send_to_gemini(self, send):
+        """Run send(session), retrying once on a fresh connection if a pre-warmed one was dead."""
+        session = self.session
+        try:
+            await send(session)
+        except Exception as e:
+            await self._recover(session, e)
+            await send(self.session)
+
+    async def _recover(self, failed_session, error: Exception):
+        """Replace a pre-warmed connection that failed before Gemini ever answered on it.
+
+        Re-raises error if the connection was fresh or had already been used.
+        """
+        async with self._recover_lock:
+            if self.session is not failed_session:
+                return  # Another task already replaced it
+            if self._verified:
+                raise error
+            logger.warning("Pre-warmed Gemini connection failed (%s); opening a fresh one", error)
+            stale = self.session_manager
+            self.session_manager, self.session = await pool.open(self.options)
+            self._verified = True
+        pool.discard(stale)
+
     async def handle_tool_call(self, tool_call):
         """Handle tool calls from Gemini."""
         try:
             function_responses = []
             for fc in tool_call.function_calls:
-                logger.info(f"Tool call received: {fc.name} with args: {fc.args}")
+                logger.info("Tool call received: %s with args: %s", fc.name, fc.args)
                 
                 # Send notification to client
-                await self.client_ws.send_json({
+                await self.send_json({
                     "type": "tool_call",
                     "tool": fc.name,
                     "args": fc.args
@@ -309,83 +660,176 @@ class GeminiSession:
             logger.info("Sent tool responses")
             
         except Exception as e:
-            logger.error(f"Error handling tool call: {e}")
+            logger.error("Error handling tool call: %s", e)
 
     async def receive_responses(self):
         """Receive and process responses from Gemini."""
         try:
-            # Keep receiving turns in a loop for multi-turn conversation
+            # session.receive() ends after each turn_complete, so keep receiving turns
+            # in a loop for multi-turn conversation; a closed Gemini socket raises
+            # APIError, which ends the loop below
             while self.is_active:
-                turn = self.session.receive()
-                async for response in turn:
-                    if not self.is_active:
-                        break
-                    
-                    # Handle tool calls
-                    if response.tool_call:
-                        await self.handle_tool_call(response.tool_call)
-
-                    # Handle audio responses - only from response.data (not from server_content)
-                    if response.data:
-                        audio_data = base64.b64encode(response.data).decode('utf-8')
-                        await self.client_ws.send_json({
-                            "type": "audio_response",
-                            "data": audio_data
-                        })
-                        logger.info(f"Sent audio response to client ({len(response.data)} bytes)")
-                    
-                    # Handle text responses (if any)
-                    if response.text:
-                        logger.info(f"Gemini text: {response.text}")
-                        await self.client_ws.send_json({
-                            "type": "transcription",
-                            "text": response.text
-                        })
-
-                    if response.server_content and response.server_content.input_transcription:
-                        user_text = response.server_content.input_transcription.text
-                        await self.client_ws.send_json({
-                            "type": "transcription",
-                            "text": user_text
-                        })
-
-                    if response.server_content and response.server_content.output_transcription:
-                        ai_text = response.server_content.output_transcription.text
-                        await self.client_ws.send_json({
-                            "type": "ai_transcription",
-                            "text": ai_text
-                        })
-
-                    # Handle server content (but NOT audio - already handled above)
-                    if response.server_content:
-                        if response.server_content.model_turn:
-                            logger.debug("Model turn received")
-                        
-                        if response.server_content.turn_complete:
-                            logger.info("Turn complete")
-                            await self.client_ws.send_json({
-                                "type": "turn_complete"
-                            })
-                        
-                        if response.server_content.interrupted:
-                            logger.info("Generation interrupted")
-                            await self.client_ws.send_json({
-                                "type": "interrupted"
-                            })
-                    
+                session = self.session
+                try:
+                    async for response in session.receive():
+                        if not self.is_active:
+                            break
+                        self._verified = True
+                        await self._handle_response(response)
+                except Exception as e:
+                    await self._recover(session, e)
+
         except Exception as e:
-            logger.error(f"Error receiving from Gemini: {e}")
+            logger.error("Error receiving from Gemini: %s", e)
             self.is_active = False
-    
+            await self.send_json({
+                "type": "error",
+                "message": str(e)
+            })
+
+    async def _handle_response(self, response):
+        """Forward one Gemini message to the client."""
+        # Handle tool calls
+        if response.tool_call:
+            await self.handle_tool_call(response.tool_call)
+
+        # Track prompt tokens served from Gemini's cache
+        if response.usage_metadata:
+            usage = response.usage_metadata
+            self.prompt_tokens += usage.prompt_token_count or 0
+            self.cached_tokens += usage.cached_content_token_count or 0
+            logger.debug("Usage: prompt=%s cached=%s", usage.prompt_token_count, usage.cached_content_token_count)
+
+        sc = response.server_content
+        if sc is None:
+            return
+
+        if sc.model_turn:
+            logger.debug("Model turn received")
+
+            # Read parts directly: response.data and response.text model_dump every
+            # part and log a warning whenever audio and text parts are mixed
+            audio_chunks = []
+            text_chunks = []
+            for part in sc.model_turn.parts or ():
+                if part.inline_data:
+                    if part.inline_data.data:
+                        audio_chunks.append(part.inline_data.data)
+                elif part.text and not part.thought:
+                    text_chunks.append(part.text)
+
+            # Handle audio responses
+            if audio_chunks:
+                audio_data = b"".join(audio_chunks)
+                if self.legacy_json:
+                    await self._send_legacy_audio(audio_data)
+                else:
+                    await self._enqueue(OP_AUDIO + audio_data)
+                logger.info("Sent audio response to client (%d bytes)", len(audio_data))
+
+            # Handle text responses (if any)
+            text = "".join(text_chunks)
+            if text:
+                logger.info("Gemini text: %s", text)
+                await self.send_json({
+                    "type": "transcription",
+                    "text": text
+                })
+
+        # Transcriptions arrive in small fragments; buffer and send them in batches
+        input_tx = sc.input_transcription
+        if input_tx:
+            self._in_tx_buf.append(input_tx.text or "")
+            self._schedule_flush()
+
+        output_tx = sc.output_transcription
+        if output_tx:
+            self._out_tx_buf.append(output_tx.text or "")
+            self._schedule_flush()
+
+        if sc.turn_complete:
+            logger.info("Turn complete")
+            await self.flush_transcriptions()
+            await self._send_ctrl(MSG_TURN_COMPLETE)
+
+        if sc.interrupted:
+            logger.info("Generation interrupted")
+            await self.flush_transcriptions()
+            await self._send_ctrl(MSG_INTERRUPTED)
+
     async def close(self):
         """Close the Gemini session."""
         self.is_active = False
+        if self.prompt_tokens:
+            logger.info("Session token usage: prompt=%s cached=%s", self.prompt_tokens, self.cached_tokens)
+        if self._flush_task:
+            self._flush_task.cancel()
+        for task in (self.audio_sender_task, self.writer_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         if self.session_manager:
             try:
-                await self.session_manager.__aexit__(None, None, None)
+                await pool.release(self.session_manager)
                 logger.info("Closed Gemini session")
             except Exception as e:
-                logger.error(f"Error closing session: {e}")
+                logger.error("Error closing session: %s", e)
+
+
+class ConnectionManager:
+    """Tracks client WebSockets and their Gemini sessions."""
+
+    def __init__(self):
+        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_sessions: Dict[str, GeminiSession] = {}
+
+    async def connect(self, websocket: WebSocket) -> str:
+        """Accept a client WebSocket and return its session id."""
+        await websocket.accept()
+        session_id = uuid.uuid4().hex
+        self.active_connections[session_id] = websocket
+        logger.info("WebSocket connection established from %s (session %s)", websocket.client, session_id)
+        return session_id
+
+    def create_session(self, session_id: str, options: SessionOptions, legacy_json: bool = False) -> GeminiSession:
+        """Create the Gemini session for a connected client."""
+        session = GeminiSession(self, session_id, options, legacy_json=legacy_json)
+        self.active_sessions[session_id] = session
+        return session
+
+    async def send_bytes(self, session_id: str, message: bytes):
+        await self.active_connections[session_id].send_bytes(message)
+
+    async def send_text(self, session_id: str, message: str):
+        await self.active_connections[session_id].send_text(message)
+
+    async def disconnect(self, session_id: str):
+        """Close the Gemini session and forget the client."""
+        session = self.active_sessions.pop(session_id, None)
+        if session:
+            await session.close()
+        if self.active_connections.pop(session_id, None) is not None:
+            logger.info("WebSocket connection closed (session %s)", session_id)
+
+    async def _close_client(self, session_id: str, websocket: WebSocket):
+        try:
+            await websocket.close(code=1001)  # Going away
+        except Exception as e:
+            logger.debug("Error closing client WebSocket: %s", e)
+        await self.disconnect(session_id)
+
+    async def close_all(self):
+        """Close every client WebSocket and its Gemini session, e.g. on server shutdown."""
+        await asyncio.gather(
+            *(self._close_client(session_id, websocket) for session_id, websocket in list(self.active_connections.items())),
+            return_exceptions=True
+        )
+
+
+manager = ConnectionManager()
 
 
 @app.get("/health")
@@ -394,23 +838,111 @@ async def health_check():
     return {
         "status": "healthy",
         "api_key_configured": bool(GOOGLE_API_KEY),
+        "active_sessions": len(manager.active_sessions),
         "timestamp": datetime.now().isoformat()
     }
 
 
+async def receive_client_message(websocket: WebSocket):
+    """Receive one client frame: raw PCM bytes for binary frames, parsed JSON for text frames."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+
+    audio_bytes = message.get("bytes")
+    if audio_bytes is not None:
+        return audio_bytes
+    return orjson.loads(message["text"])
+
+
+async def _handle_audio(session: GeminiSession, data: dict) -> bool:
+    # Legacy clients still send base64 audio inside JSON; decode it off the event loop
+    audio_base64 = data.get("data")
+    if audio_base64:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received audio chunk: %d bytes", len(audio_base64))
+        loop = asyncio.get_running_loop()
+        audio_bytes = await loop.run_in_executor(None, base64.b64decode, audio_base64)
+        await session.send_audio(audio_bytes)
+    return False
+
+
+async def _handle_end_of_turn(session: GeminiSession, data: dict) -> bool:
+    logger.info("User finished speaking - sending realtime end signal to Gemini")
+    # Send explicit end signal for realtime audio input
+    if session.session:
+        try:
+            # For realtime audio, the end-of-speech signal is audio_stream_end
+            await session.send_control(lambda s: s.send_realtime_input(audio_stream_end=True))
+            logger.info("Sent realtime audio_stream_end signal to Gemini successfully")
+        except Exception as e:
+            logger.error("Error sending end_of_turn: %s", e)
+    return False
+
+
+async def _handle_text(session: GeminiSession, data: dict) -> bool:
+    # Temporary: Support text input for testing when audio streaming not available
+    text = data.get("text", "")
+    if text:
+        logger.info("Received text message: %s", text)
+        await session.send_control(lambda s: s.send(input=text, end_of_turn=True))
+    return False
+
+
+async def _handle_stop(session: GeminiSession, data: dict) -> bool:
+    logger.info("Client requested stop")
+    return True
+
+
+# Client JSON message type -> handler; a handler returns True to end the session
+CLIENT_MESSAGE_HANDLERS = {
+    "audio_chunk": _handle_audio,
+    "end_of_turn": _handle_end_of_turn,
+    "text_message": _handle_text,
+    "stop": _handle_stop,
+}
+
+
+async def _client_loop(session: GeminiSession, websocket: WebSocket, pending_message=None):
+    """Process client messages until the client stops, disconnects or the session ends."""
+    while session.is_active:
+        try:
+            # Receive message from client
+            if pending_message is not None:
+                data = pending_message
+                pending_message = None
+            else:
+                data = await receive_client_message(websocket)
+
+            # Binary frames carry raw PCM audio
+            if isinstance(data, bytes):
+                if data:
+                    await session.send_audio(data)
+                continue
+
+            handler = CLIENT_MESSAGE_HANDLERS.get(data.get("type"))
+            if handler is not None and await handler(session, data):
+                break
+
+        except WebSocketDisconnect:
+            logger.info("Client disconnected")
+            break
+        except Exception as e:
+            logger.error("Error processing client message: %s", e)
+            break
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for audio streaming."""
-    await websocket.accept()
-    client_address = websocket.client
-    logger.info(f"WebSocket connection established from {client_address}")
+    session_id = await manager.connect(websocket)
     
     requested_voice = None
+    caps = {}
     pending_message = None
 
     try:
-        initial_message = await asyncio.wait_for(websocket.receive_text(), timeout=1.0)
-        initial_data = json.loads(initial_message)
+        initial_data = await asyncio.wait_for(receive_client_message(websocket), timeout=1.0)
         pending_message = initial_data
 
         if isinstance(initial_data, dict):
@@ -418,106 +950,75 @@ async def websocket_endpoint(websocket: WebSocket):
             if isinstance(potential_voice, str) and potential_voice.strip():
                 requested_voice = potential_voice.strip()
 
-            if initial_data.get("type") in {"start", "start_session"}:
+            # Optional client capabilities; features are on unless explicitly disabled
+            potential_caps = initial_data.get("caps")
+            if isinstance(potential_caps, dict):
+                caps = potential_caps
+
+            if initial_data.get("type") in {"start", "start_session", "hello"}:
                 pending_message = None
     except asyncio.TimeoutError:
         pass
     except WebSocketDisconnect:
         logger.info("Client disconnected before session start")
+        await manager.disconnect(session_id)
         return
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.warning("Initial WebSocket message was not valid JSON; continuing with default voice")
     except Exception as e:
-        logger.warning(f"Error parsing initial WebSocket message: {e}")
+        logger.warning("Error parsing initial WebSocket message: %s", e)
 
     selected_voice = requested_voice or DEFAULT_VOICE_NAME
-    logger.info(f"Using voice: {selected_voice}")
+    logger.info("Using voice: %s", selected_voice)
 
-    session = GeminiSession(websocket, voice_name=selected_voice)
+    options = SessionOptions(
+        voice_name=selected_voice,
+        input_tx=caps.get("input_transcription") is not False,
+        output_tx=caps.get("output_transcription") is not False,
+        thoughts=caps.get("thoughts") is not False,
+    )
+    session = manager.create_session(session_id, options, legacy_json=caps.get("legacy_json") is True)
     
     try:
         # Connect to Gemini
         await session.connect()
         
-        # Start receiving responses in background
-        receive_task = asyncio.create_task(session.receive_responses())
-        
-        # Process client messages
-        while session.is_active:
-            try:
-                # Receive message from client
-                if pending_message is not None:
-                    data = pending_message
-                    pending_message = None
-                else:
-                    message = await websocket.receive_text()
-                    data = json.loads(message)
-                
-                if data.get("type") == "audio_chunk":
-                    audio_base64 = data.get("data")
-                    if audio_base64:
-                        logger.debug(f"Received audio chunk: {len(audio_base64)} bytes")
-                        await session.send_audio(audio_base64)
-                
-                elif data.get("type") == "end_of_turn":
-                    logger.info("User finished speaking - sending realtime end signal to Gemini")
-                    # Send explicit end signal for realtime audio input
-                    if session.session:
-                        try:
-                            # For realtime audio, we need to send an end-of-speech signal
-                            await session.session.send_realtime_input(end_of_turn=True)
-                            logger.info("Sent realtime end_of_turn signal to Gemini successfully")
-                        except Exception as e:
-                            logger.error(f"Error sending end_of_turn: {e}")
-                
-                elif data.get("type") == "text_message":
-                    # Temporary: Support text input for testing when audio streaming not available
-                    text = data.get("text", "")
-                    if text:
-                        logger.info(f"Received text message: {text}")
-                        await session.session.send(input=text, end_of_turn=True)
-                        
-                elif data.get("type") == "stop":
-                    logger.info("Client requested stop")
-                    break
-                    
-            except WebSocketDisconnect:
-                logger.info("Client disconnected")
-                break
-            except Exception as e:
-                logger.error(f"Error processing client message: {e}")
-                break
-        
-        # Cancel receive task
-        receive_task.cancel()
-        try:
-            await receive_task
-        except asyncio.CancelledError:
-            pass
+        # Receive Gemini responses alongside the client loop; the task group
+        # waits for the cancelled receive task before exiting
+        async with asyncio.TaskGroup() as tg:
+            receive_task = tg.create_task(session.receive_responses())
+            await _client_loop(session, websocket, pending_message)
+            receive_task.cancel()
             
     except Exception as e:
-        logger.error(f"WebSocket error: {e}")
+        logger.error("WebSocket error: %s", e)
         try:
-            await websocket.send_json({
+            error_frame = OP_CTRL + orjson.dumps({
                 "type": "error",
                 "message": str(e)
             })
+            if session.legacy_json:
+                await manager.send_text(session_id, error_frame[1:].decode())
+            else:
+                await manager.send_bytes(session_id, error_frame)
         except:
             pass
     finally:
-        await session.close()
-        logger.info("WebSocket connection closed")
+        await manager.disconnect(session_id)
 
 
 if __name__ == "__main__":
     import uvicorn
     
-    logger.info(f"Starting Gemini Live API Backend on port 8000")
-    logger.info(f"API Key configured: {bool(GOOGLE_API_KEY)}")
+    logger.info("Starting Gemini Live API Backend on port 8000")
+    logger.info("API Key configured: %s", bool(GOOGLE_API_KEY))
     
     uvicorn.run(
         app,
         host="0.0.0.0",
         port=8000,
-        log_level="info"
+        log_level="info",
+        loop="uvloop",
+        http="httptools",
+        ws="websockets"
     )